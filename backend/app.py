@@ -5,181 +5,501 @@ Integrates the existing Python DICOM processing code with a REST API
 """
 
 import os
-import sys
-import json
 import uuid
+import time
 import tempfile
 import shutil
-import zipfile
-from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from collections import OrderedDict
+from flask import Flask, Request, Response, current_app, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
 import threading
 import traceback
+import multiprocessing
+import mmap
+import gzip
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+# Optional Celery task queue; jobs run on in-process threads when unavailable
+try:
+    from celery import Celery, chain, current_task
+except ImportError:
+    Celery = None
+    chain = None
+    current_task = None
+
+# Optional compact serializer for Celery messages; falls back to JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Optional fast JSON encoder; falls back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional response compression
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+from job_store import create_job_store
+from json_utils import json_default
+from upload_utils import (HashingFile, allowed_file, is_archive, save_upload, claim_name, extract_dicom_from_zip,
+                          has_dicom_header, parses_as_dicom, series_digest)
+
 # Import the existing DICOM processing modules
 try:
-    from dicom_processing import EnhancedDicom2D, DicomTo3D
+    from dicom_processing import EnhancedDicom2D, DicomTo3D, analyze_dicom_file
 except ImportError:
     print("Warning: DICOM processing modules not found. Please ensure dicom_2d_main.py and paste-2.py are available.")
     EnhancedDicom2D = None
     DicomTo3D = None
+    analyze_dicom_file = None
+
+class StreamingRequest(Request):
+    """Request that keeps at most 1MB of non-file form data in memory and spools files into the upload folder"""
+    max_form_memory_size = 1024 * 1024
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Spooling on the upload filesystem lets save_upload link the file into place instead of copying it;
+        # the file is hashed as it arrives, for duplicate detection
+        return HashingFile(tempfile.NamedTemporaryFile('wb+', dir=current_app.config['UPLOAD_FOLDER'], prefix='.upload-'))
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed"""
+    default = staticmethod(json_default)
+    
+    def dumpb(self, obj, **kwargs):
+        """Serialize to UTF-8 bytes, skipping the str round-trip when orjson is available"""
+        if orjson is None:
+            return super().dumps(obj, **kwargs).encode()
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=json_default, option=option)
+    
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj, **kwargs).decode()
+    
+    def response(self, *args, **kwargs):
+        # Same as DefaultJSONProvider.response, but hands the encoded bytes straight to the response
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args = {'indent': 2}
+        else:
+            dump_args = {'separators': (',', ':')}
+        return self._app.response_class(self.dumpb(obj, **dump_args) + b'\n', mimetype=self.mimetype)
+    
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.request_class = StreamingRequest
+app.json = ORJSONProvider(app)
 CORS(app, origins=['http://localhost:8080', 'http://127.0.0.1:8080', 'http://localhost:8081', 'http://127.0.0.1:8081', 'http://localhost:3000'], 
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
      allow_headers=['Content-Type', 'Authorization'],
+     expose_headers=['Location'],
      supports_credentials=True)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 RESULTS_FOLDER = 'results'
-ALLOWED_EXTENSIONS = {'dcm', 'dicom', 'zip'}
 MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max file size
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', max(1, (os.cpu_count() or 1) - 1)))  # Job processes without Celery; 0 uses threads
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))  # 2D analysis processes, split between the local job processes
+LARGE_DOWNLOAD_SIZE = 64 * 1024 * 1024  # Result files from this size are streamed from a memory map
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+STREAM_KEEPALIVE_SECONDS = 15  # Idle interval before a progress stream re-checks the job
+MAX_STATUS_WAIT_SECONDS = 30  # Upper bound for long-polling /status?wait=
+# Storage type of the smoothed CT volume; int16 holds whole HU in half the memory of float32
+VOLUME_DTYPES = ('float32', 'int16', 'int32')
+VOLUME_DTYPE = os.environ.get('VOLUME_DTYPE', 'float32')
+if VOLUME_DTYPE not in VOLUME_DTYPES:
+    raise ValueError(f"VOLUME_DTYPE must be one of {', '.join(VOLUME_DTYPES)}, not {VOLUME_DTYPE!r}")
+
+# Task queue configuration (uploads and results must live on storage shared with the workers)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+RECONSTRUCTION_QUEUE = os.environ.get('RECONSTRUCTION_QUEUE', 'reconstruction')
+CELERY_SERIALIZER = 'msgpack' if msgpack else 'json'
+# Mesh generation can be routed to its own (e.g. GPU or high-memory) workers
+RECONSTRUCTION_3D_QUEUE = os.environ.get('RECONSTRUCTION_3D_QUEUE', 'reconstruction-3d')
+
+# Job registry configuration (Redis shares job state across hosts, SQLite across processes on one host)
+REDIS_URL = os.environ.get('REDIS_URL')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH')
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 24 * 3600))
+MAX_JOBS = int(os.environ.get('MAX_JOBS', 1000))  # In-memory store only; every store expires jobs after JOB_TTL_SECONDS
+# Job directories untouched for this long and unknown to the job store are removed by the periodic sweep
+ORPHAN_GRACE_SECONDS = int(os.environ.get('ORPHAN_GRACE_SECONDS', 3600))
+JOB_SWEEP_INTERVAL = int(os.environ.get('JOB_SWEEP_INTERVAL', 3600))
+# Re-uploads of a series that is already processed (or processing) return the existing job
+DEDUPLICATE_UPLOADS = os.environ.get('DEDUPLICATE_UPLOADS', 'true').lower() in ('1', 'true', 'yes')
+
+# Files written to a job's result directory, by download type
+RESULT_FILES = {
+    'stl': '3d_model.stl',
+    'obj': '3d_model.obj',
+    'ply': '3d_model.ply',
+    'report': 'analysis_report.json'
+}
+MODEL_FORMATS = ('ply', 'stl', 'obj')
+DEFAULT_MODEL_FORMATS = ['ply']  # STL and OBJ can still be converted from the PLY on download
+# STL and OBJ have registered media types; binary PLY is served as a plain byte stream
+RESULT_MIMETYPES = {
+    'stl': 'model/stl',
+    'obj': 'model/obj',
+    'ply': 'application/octet-stream',
+    'report': 'application/json'
+}
+# Text meshes are gzipped once when written, so downloads don't recompress them on every request
+PRECOMPRESSED_RESULT_TYPES = ('obj',)
+# A finished job's result files never change, so browsers may reuse downloads without revalidating
+RESULT_MAX_AGE = int(os.environ.get('RESULT_MAX_AGE', 3600))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+app.config['VOLUME_DTYPE'] = VOLUME_DTYPE
+# Let a reverse proxy (Apache mod_xsendfile, lighttpd) serve result files itself
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+# Compress JSON and text OBJ meshes; binary STL/PLY barely shrink and event streams must not be buffered
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'model/obj', 'text/plain']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_REGISTER'] = False
+app.config['COMPRESS_STREAMING_ENDPOINT_CONDITIONAL'] = ['get_job_results', 'download_result_file']
+compress = Compress(app) if Compress else None
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
-# Store processing jobs
-processing_jobs = {}
+if Celery and CELERY_BROKER_URL:
+    celery = Celery('bone_reconstruction', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+    celery.conf.update(
+        task_track_started=True,
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+        task_serializer=CELERY_SERIALIZER,
+        result_serializer=CELERY_SERIALIZER,
+        accept_content=['msgpack', 'json'] if msgpack else ['json'],
+        task_routes={
+            'analyze_dicom_2d_task': {'queue': RECONSTRUCTION_QUEUE},
+            'reconstruct_dicom_3d_task': {'queue': RECONSTRUCTION_3D_QUEUE},
+            'cleanup_job_task': {'queue': RECONSTRUCTION_QUEUE}
+        }
+    )
+else:
+    celery = None
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def remove_job_files(job_id, job=None):
+    """Remove a job's upload and result directories"""
+    for job_dir in (os.path.join(UPLOAD_FOLDER, job_id), os.path.join(RESULTS_FOLDER, job_id)):
+        if os.path.exists(job_dir):
+            shutil.rmtree(job_dir, ignore_errors=True)
 
-def extract_dicom_from_zip(zip_path, extract_dir):
-    """Extract DICOM files from ZIP archive with improved detection"""
-    extracted_files = []
+def purge_orphaned_job_files():
+    """Remove upload and result directories left behind by jobs the store no longer knows (e.g. after a crash)"""
+    if celery is not None and not processing_jobs.shared:
+        return  # Queued jobs are only known to the Celery backend, not to this process's store
     
+    known_jobs = set(processing_jobs.job_ids())
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    for folder in (UPLOAD_FOLDER, RESULTS_FOLDER):
+        for entry in os.scandir(folder):
+            # The grace period spares uploads still being received, whose job doesn't exist yet
+            if entry.is_dir() and entry.name not in known_jobs and entry.stat().st_mtime < cutoff:
+                print(f"Removing orphaned job directory: {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+def sweep_jobs():
+    """Expire jobs past their TTL and remove orphaned job directories, at startup and then every JOB_SWEEP_INTERVAL"""
+    while True:
+        try:
+            # Listing the jobs evicts expired in-memory jobs (removing their files) and prunes expired shared entries
+            processing_jobs.job_ids()
+            purge_orphaned_job_files()
+        except Exception as e:
+            print(f"Error sweeping jobs: {e}")
+        time.sleep(JOB_SWEEP_INTERVAL)
+
+def schedule_job_cleanup(job_id, job=None):
+    """Remove a job's files in the background, on a Celery worker when one is configured"""
+    if celery is not None:
+        cleanup_job_task.delay(job_id)
+    else:
+        threading.Thread(target=remove_job_files, args=(job_id,), daemon=True).start()
+
+# Store processing jobs
+processing_jobs = create_job_store(
+    REDIS_URL, JOB_TTL_SECONDS, MAX_JOBS, on_evict=schedule_job_cleanup, sqlite_path=JOB_DB_PATH
+)
+
+# Ids of the latest jobs deleted while only Celery's result backend tracked them, so they aren't rebuilt
+deleted_job_ids = OrderedDict()
+deleted_job_ids_lock = threading.Lock()
+
+# Local job processes, used when Celery isn't configured
+job_executor = None
+job_executor_lock = threading.Lock()
+job_manager = None
+job_update_queue = None  # Set inside job processes that relay updates to the API process
+cancelled_jobs = None  # Ids of deleted jobs, shared with the local job processes
+
+# 2D analysis pool, created once per process and shared by its jobs
+analysis_executor = None
+analysis_workers = ANALYSIS_WORKERS  # Lowered inside local job processes, which each get their own pool
+analysis_executor_lock = threading.Lock()
+
+class JobCancelled(KeyError):
+    """Raised inside a running job when the job was deleted meanwhile"""
+
+def job_task_ids(job_id):
+    """Celery task ids of a job's 2D and 3D stages"""
+    return job_id, f'{job_id}-3d'
+
+def update_job(job_id, **fields):
+    """Update a job's fields and report progress to Celery when running inside a task"""
+    # A job process keeps a private copy of its job, so deletions reach it through cancelled_jobs
+    if cancelled_jobs is not None and job_id in cancelled_jobs:
+        raise JobCancelled(job_id)
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # List all files in the ZIP
-            file_list = zip_ref.namelist()
-            print(f"ZIP contains {len(file_list)} files: {[os.path.basename(f) for f in file_list[:10]]}")
-            
-            # Filter out directories and get only files
-            files_only = [f for f in file_list if not f.endswith('/') and not os.path.basename(f).startswith('.')]
-            
-            # First pass: Look for files with DICOM extensions
-            dicom_files = [f for f in files_only if f.lower().endswith(('.dcm', '.dicom', '.dic', '.ima'))]
-            
-            # Second pass: If no DICOM extensions found, check all files by content
-            if not dicom_files:
-                print("No files with DICOM extensions found. Checking all files by content...")
-                potential_files = files_only
+        processing_jobs.update(job_id, **fields)
+    except KeyError:
+        raise JobCancelled(job_id) from None
+    
+    # In a local job process, relay the update to the API process's private store
+    if job_update_queue is not None:
+        job_update_queue.put((job_id, fields))
+    
+    # A shared store is already visible to the API; otherwise relay the state through Celery
+    if celery is not None and not processing_jobs.shared and current_task and current_task.request.id in job_task_ids(job_id):
+        job = processing_jobs.get(job_id)
+        current_task.update_state(state='PROGRESS', meta=app.json.loads(app.json.dumps(job)))
+
+def get_analysis_executor():
+    """Return this process's 2D analysis pool, creating it on first use"""
+    global analysis_executor
+    with analysis_executor_lock:
+        if analysis_executor is None:
+            # Daemonic processes (e.g. Celery's prefork pool) can't have children, so they fall back to
+            # threads, which still overlap pydicom I/O and numpy work
+            if multiprocessing.current_process().daemon:
+                analysis_executor = ThreadPoolExecutor(max_workers=analysis_workers)
             else:
-                potential_files = dicom_files
-            
-            # Extract and validate files
-            for file_path in potential_files:
-                try:
-                    # Extract to temporary location first
-                    zip_ref.extract(file_path, extract_dir)
-                    extracted_path = os.path.join(extract_dir, file_path)
-                    
-                    # Flatten nested directory structure
-                    if os.path.dirname(file_path):
-                        flat_name = os.path.basename(file_path)
-                        flat_path = os.path.join(extract_dir, flat_name)
-                        if extracted_path != flat_path:
-                            os.makedirs(os.path.dirname(flat_path), exist_ok=True)
-                            shutil.move(extracted_path, flat_path)
-                            extracted_path = flat_path
-                    
-                    # Validate that the extracted file is actually a DICOM file
-                    if is_dicom_file(extracted_path):
-                        extracted_files.append(extracted_path)
-                        print(f"Extracted valid DICOM file: {os.path.basename(file_path)}")
-                    else:
-                        print(f"Skipping non-DICOM file: {os.path.basename(file_path)}")
-                        # Remove the invalid file
-                        if os.path.exists(extracted_path):
-                            os.remove(extracted_path)
-                            
-                except Exception as e:
-                    print(f"Error extracting {file_path}: {e}")
-                    continue
-            
-            if not extracted_files:
-                raise ValueError(f"No valid DICOM files found in ZIP archive. Checked {len(potential_files)} files.")
-            
-            print(f"Successfully extracted {len(extracted_files)} DICOM files")
-            return extracted_files
-            
-    except zipfile.BadZipFile:
-        raise ValueError("Invalid ZIP file format")
-    except Exception as e:
-        raise ValueError(f"Error extracting ZIP file: {str(e)}")
+                analysis_executor = ProcessPoolExecutor(max_workers=analysis_workers)
+        return analysis_executor
+
+def discard_analysis_executor(executor):
+    """Drop a broken 2D analysis pool so the next job starts a fresh one"""
+    global analysis_executor
+    with analysis_executor_lock:
+        if analysis_executor is executor:
+            analysis_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
 
-def is_dicom_file(file_path):
-    """Check if a file is a valid DICOM file with multiple detection methods"""
+def submit_analysis(file_paths):
+    """Queue the 2D analysis of every file, returning the pool used and a future -> file index mapping"""
+    executor = get_analysis_executor()
     try:
-        with open(file_path, 'rb') as f:
-            # Method 1: Check for DICOM signature at offset 128
-            f.seek(128)
-            signature = f.read(4)
-            if signature == b'DICM':
-                return True
-            
-            # Method 2: Check for DICOM signature at beginning (some DICOM files)
-            f.seek(0)
-            first_bytes = f.read(4)
-            if first_bytes == b'DICM':
-                return True
-            
-            # Method 3: Try to parse with pydicom (more reliable but slower)
-            try:
-                import pydicom
-                f.seek(0)
-                # Try to read just the header to validate
-                pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
-                return True
-            except:
-                pass
-            
-            # Method 4: Check file size and some common DICOM patterns
-            f.seek(0)
-            file_size = os.path.getsize(file_path)
-            if file_size > 1024:  # DICOM files are usually larger than 1KB
-                # Look for common DICOM tags in first 1KB
-                header = f.read(1024)
-                # Check for common DICOM UIDs or tags
-                dicom_patterns = [
-                    b'1.2.840.10008',  # DICOM UID prefix
-                    b'DICM',
-                    b'\x08\x00\x05\x00',  # Specific Charset tag
-                    b'\x08\x00\x16\x00',  # SOP Class UID tag
-                    b'\x10\x00\x10\x00',  # Patient Name tag
-                ]
-                
-                for pattern in dicom_patterns:
-                    if pattern in header:
-                        return True
-            
+        return executor, {executor.submit(analyze_dicom_file, file_path): i for i, file_path in enumerate(file_paths)}
+    except BrokenExecutor:
+        # A worker died while the pool sat idle between jobs
+        discard_analysis_executor(executor)
+        executor = get_analysis_executor()
+        return executor, {executor.submit(analyze_dicom_file, file_path): i for i, file_path in enumerate(file_paths)}
+
+def running_job(job_id):
+    """Return a running job's fields, raising JobCancelled if the job was deleted"""
+    job = processing_jobs.get(job_id)
+    if job is None:
+        raise JobCancelled(job_id)
+    return job
+
+def discard_cancelled_job(job_id):
+    """Stop processing a deleted job and remove whatever files it already wrote"""
+    print(f"Job {job_id} was deleted while processing, discarding its files")
+    remove_job_files(job_id)
+
+def get_job(job_id):
+    """Look up a job, merging in the Celery task state for queued jobs"""
+    job = processing_jobs.get(job_id)
+    if celery is None or processing_jobs.shared or (job is not None and job.get('status') in ('completed', 'error')):
+        return job
+    
+    # A deleted job's task may still report its final state; don't bring the job back from it
+    if job_id in deleted_job_ids:
+        return None
+    
+    # Follow the latest stage that the workers have picked up
+    for task_id in reversed(job_task_ids(job_id)):
+        result = celery.AsyncResult(task_id)
+        if result.state != 'PENDING':
+            break
+    state = result.state
+    if state == 'PENDING':
+        # Either still waiting in the queue or unknown to the result backend
+        return job
+    
+    if job is None:
+        # Job was submitted before this process started; rebuild it from the task state
+        job = {'status': 'queued', 'progress': 0}
+    
+    if state in ('PROGRESS', 'SUCCESS') and isinstance(result.info, dict):
+        job.update(result.info)
+    elif state == 'STARTED':
+        job['status'] = 'processing'
+    elif state == 'FAILURE':
+        job['status'] = 'error'
+        job['error'] = f"Processing failed: {result.info}"
+    
+    processing_jobs.create(job_id, job)
+    return job
+
+def iter_file_mmap(file_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield a file's contents from a read-only memory map in large chunks"""
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset in range(0, len(mm), chunk_size):
+            yield mm[offset:offset + chunk_size]
+
+def convert_model_file(result_dir, file_type, file_path):
+    """Create a job's STL or OBJ model from its stored PLY model"""
+    ply_path = os.path.join(result_dir, RESULT_FILES['ply'])
+    if DicomTo3D is None or not os.path.exists(ply_path):
         return False
-    except Exception as e:
-        print(f"Error checking DICOM file {file_path}: {e}")
+    
+    model = DicomTo3D(result_dir)
+    if not model.load_model(ply_path):
         return False
+    
+    # Write under a private name first so concurrent downloads never serve a partial file
+    tmp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        if not model.save_model(tmp_path, file_type):
+            return False
+        os.replace(tmp_path, file_path)
+        if file_type in PRECOMPRESSED_RESULT_TYPES:
+            precompress_result_file(file_path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def precompress_result_file(file_path):
+    """Write a gzip copy of a result file next to it, served to clients that accept gzip"""
+    tmp_path = f'{file_path}.gz.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(file_path, 'rb') as source, gzip.open(tmp_path, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(tmp_path, f'{file_path}.gz')
+    except OSError as e:
+        print(f"Error compressing {file_path}: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def process_dicom_files(job_id, file_paths):
     """Process DICOM files using real algorithms from the repository"""
+    # The 3D stage reads the slice headers itself and their pixels one block at a time, rather than
+    # holding on to every dataset (pixels included) that the 2D stage parsed
+    analysis_results = analyze_dicom_2d(job_id, file_paths)
+    if analysis_results is not None:
+        reconstruct_dicom_3d(job_id, file_paths, analysis_results)
+
+def fail_job(job_id, e):
+    """Mark a job as failed, logging the current exception's traceback"""
+    error_msg = f"Processing failed: {str(e)}"
+    print(f"Error processing job {job_id}: {error_msg}")
+    # The traceback only goes to the log; keeping it in every failed job's record just costs store memory
+    traceback.print_exc()
+    
     try:
-        processing_jobs[job_id]['status'] = 'processing'
-        processing_jobs[job_id]['progress'] = 5
+        update_job(job_id, status='error', error=error_msg)
+    except JobCancelled:
+        discard_cancelled_job(job_id)
+
+def find_duplicate_job(series_hash, formats):
+    """Return (id, job) of a live job for the same series that can serve the requested formats, or (None, None)"""
+    job_id = processing_jobs.find_series(series_hash)
+    job = get_job(job_id) if job_id else None
+    if job is None or job.get('status') == 'error' or job.get('series_hash') != series_hash:
+        return None, None
+    
+    # A job that completed with a failed reconstruction has nothing to reuse; upload the series afresh
+    if 'error' in (job.get('results') or {}):
+        return None, None
+    
+    # Any model format can be converted from a PLY; otherwise the earlier job must have written them all
+    job_formats = job.get('formats', DEFAULT_MODEL_FORMATS)
+    if 'ply' not in job_formats and not set(formats) <= set(job_formats):
+        return None, None
+    return job_id, job
+
+def wait_for_job(job_id, wait, last_progress=None):
+    """Long-poll a job until its progress moves past last_progress (default: current) or it finishes"""
+    # Subscribe before reading the job so an update can't slip in between
+    events = processing_jobs.listen(job_id, timeout=min(wait, 1.0))
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return None
+        
+        baseline = job.get('progress') if last_progress is None else last_progress
+        deadline = time.monotonic() + wait
+        while (job is not None and job.get('status') not in ('completed', 'error')
+               and job.get('progress') == baseline and time.monotonic() < deadline):
+            # Wakes up on the next update, or after a second to re-check the job and the deadline
+            next(events)
+            job = get_job(job_id)
+        return job
+    finally:
+        events.close()
+
+def save_report(job_id, analysis_results):
+    """Write the analysis report to the job's result directory and return its path"""
+    report_path = os.path.join(RESULTS_FOLDER, job_id, RESULT_FILES['report'])
+    with open(report_path, 'wb') as f:
+        f.write(app.json.dumpb(analysis_results, indent=2))
+    return report_path
+
+def split_common_patient_info(files_info):
+    """Move the patient/study tags shared by every slice out of files_info, returning them once"""
+    if not files_info:
+        return {}
+    
+    # A series repeats the same patient and study tags on every slice; keep only what varies per slice
+    first = files_info[0]['patient_info']
+    common = {
+        name: value for name, value in first.items()
+        if all(name in info['patient_info'] and info['patient_info'][name] == value for info in files_info)
+    }
+    for info in files_info:
+        info['patient_info'] = {name: value for name, value in info['patient_info'].items() if name not in common}
+    return common
+
+def analyze_dicom_2d(job_id, file_paths):
+    """Run the per-file 2D analysis stage, returning the partial analysis results or None on failure"""
+    try:
+        update_job(job_id, status='processing', progress=5)
         
         # Create job result directory
         job_result_dir = os.path.join(RESULTS_FOLDER, job_id)
         os.makedirs(job_result_dir, exist_ok=True)
         
-        processing_jobs[job_id]['progress'] = 10
+        update_job(job_id, progress=10)
         
         # Real processing starts here
         print(f"Starting real DICOM processing for job {job_id}")
@@ -195,76 +515,109 @@ def process_dicom_files(job_id, file_paths):
         
         # Process 2D analysis first for each individual file
         if EnhancedDicom2D:
-            processing_jobs[job_id]['progress'] = 15
+            update_job(job_id, progress=15)
             print("Starting 2D DICOM analysis...")
             
-            dicom_2d = EnhancedDicom2D()
+            file_results = [None] * len(file_paths)
+            reported_progress = 15
             
-            for i, file_path in enumerate(file_paths):
-                try:
-                    print(f"Processing 2D analysis for: {os.path.basename(file_path)}")
-                    
-                    # Load and analyze each DICOM file
-                    if dicom_2d.load_dicom(file_path):
-                        file_analysis = dicom_2d.analyze_image()
-                        if file_analysis:
-                            file_info = {
-                                'filename': os.path.basename(file_path),
-                                'patient_info': dicom_2d.patient_info,
-                                'analysis': file_analysis
-                            }
-                            analysis_results['files_info'].append(file_info)
-                    
-                    # Update progress for 2D processing (15-35%)
-                    progress = 15 + (i + 1) * 20 // len(file_paths)
-                    processing_jobs[job_id]['progress'] = progress
+            # Analyze files on the process's long-lived pool, so jobs don't pay for starting workers
+            if min(analysis_workers, len(file_paths)) > 1:
+                executor, futures = submit_analysis(file_paths)
+                completed = ((futures[future], future) for future in as_completed(futures))
+            else:
+                executor = None
+                completed = ((i, file_path) for i, file_path in enumerate(file_paths))
+            
+            broken = False
+            try:
+                for done, (i, task) in enumerate(completed):
+                    file_path = file_paths[i]
+                    try:
+                        print(f"Processing 2D analysis for: {os.path.basename(file_path)}")
+                        
+                        # Load and analyze each DICOM file
+                        file_results[i] = task.result() if executor else analyze_dicom_file(task)
+                        
+                    except Exception as e:
+                        print(f"Error processing 2D analysis for {file_path}: {e}")
+                        broken = broken or isinstance(e, BrokenExecutor)
                     
-                except Exception as e:
-                    print(f"Error processing 2D analysis for {file_path}: {e}")
+                    # Update progress for 2D processing (15-35%), only when the percentage changes
+                    progress = 15 + (done + 1) * 20 // len(file_paths)
+                    if progress != reported_progress:
+                        update_job(job_id, progress=progress)
+                        reported_progress = progress
+            finally:
+                if executor:
+                    # The pool outlives this job: only drop its queued files, unless a worker died
+                    for future in futures:
+                        future.cancel()
+                    if broken:
+                        discard_analysis_executor(executor)
+            
+            # Collect results in upload order, whatever order the workers finished in
+            for file_path, file_result in zip(file_paths, file_results):
+                if file_result is None:
                     continue
+                if file_result['analysis']:
+                    analysis_results['files_info'].append({
+                        'filename': os.path.basename(file_path),
+                        'patient_info': file_result['patient_info'],
+                        'analysis': file_result['analysis']
+                    })
+            
+            analysis_results['patient_info_common'] = split_common_patient_info(analysis_results['files_info'])
+        
+        update_job(job_id, progress=40)
+        return analysis_results
         
-        processing_jobs[job_id]['progress'] = 40
+    except JobCancelled:
+        discard_cancelled_job(job_id)
+        return None
+    except Exception as e:
+        fail_job(job_id, e)
+        return None
+
+def reconstruct_dicom_3d(job_id, file_paths, analysis_results):
+    """Run the 3D reconstruction stage and complete the job with the final report"""
+    try:
+        job_result_dir = os.path.join(RESULTS_FOLDER, job_id)
         
         # Process 3D reconstruction using all files
         if DicomTo3D and file_paths:
             print("Starting 3D reconstruction...")
             
             # Use directory containing the files for batch processing
-            dicom_dir = os.path.dirname(file_paths[0])
+            dicom_dir = os.path.join(UPLOAD_FOLDER, job_id)  # Direct and ZIP-extracted files all live here
             
             try:
                 dicom_3d = DicomTo3D(dicom_dir)
-                processing_jobs[job_id]['progress'] = 45
+                dicom_3d.volume_dtype = app.config['VOLUME_DTYPE']
+                update_job(job_id, progress=45)
                 
                 # Load DICOM series
                 print("Loading DICOM series for 3D reconstruction...")
                 if dicom_3d.load_dicom_series():
-                    processing_jobs[job_id]['progress'] = 55
+                    update_job(job_id, progress=55)
                     
                     # Create 3D model
                     print("Creating 3D bone model...")
                     if dicom_3d.create_3d_model():
-                        processing_jobs[job_id]['progress'] = 75
+                        update_job(job_id, progress=75)
                         
-                        # Save models in multiple formats
+                        # Save only the requested formats (binary PLY by default); STL and OBJ
+                        # can be converted from the PLY when first downloaded
                         print("Saving 3D models...")
+                        formats = running_job(job_id).get('formats', DEFAULT_MODEL_FORMATS)
+                        for model_format in formats:
+                            model_path = os.path.join(job_result_dir, RESULT_FILES[model_format])
+                            if dicom_3d.save_model(model_path, model_format):
+                                print(f"{model_format.upper()} model saved: {model_path}")
+                                if model_format in PRECOMPRESSED_RESULT_TYPES:
+                                    precompress_result_file(model_path)
                         
-                        # Save STL
-                        stl_path = os.path.join(job_result_dir, '3d_model.stl')
-                        if dicom_3d.save_model(stl_path, 'stl'):
-                            print(f"STL model saved: {stl_path}")
-                        
-                        # Save OBJ
-                        obj_path = os.path.join(job_result_dir, '3d_model.obj')
-                        if dicom_3d.save_model(obj_path, 'obj'):
-                            print(f"OBJ model saved: {obj_path}")
-                        
-                        # Save PLY
-                        ply_path = os.path.join(job_result_dir, '3d_model.ply')
-                        if dicom_3d.save_model(ply_path, 'ply'):
-                            print(f"PLY model saved: {ply_path}")
-                        
-                        processing_jobs[job_id]['progress'] = 85
+                        update_job(job_id, progress=85)
                         
                         # Get comprehensive 3D analysis
                         model_info = dicom_3d.get_analysis_info()
@@ -293,8 +646,7 @@ def process_dicom_files(job_id, file_paths):
                         
                         # Calculate resolution based on spacing
                         if model_info.get('spacing_mm'):
-                            spacing = model_info['spacing_mm']
-                            analysis_results['resolution'] = f"{spacing[0]:.1f}mm × {spacing[1]:.1f}mm × {spacing[2]:.1f}mm"
+                            analysis_results['resolution'] = ' × '.join(f"{value:.1f}mm" for value in model_info['spacing_mm'])
                         else:
                             analysis_results['resolution'] = "N/A"
                         
@@ -306,16 +658,18 @@ def process_dicom_files(job_id, file_paths):
                     print("Failed to load DICOM series for 3D reconstruction")
                     analysis_results['error'] = "Failed to load DICOM series"
                     
+            except JobCancelled:
+                raise
             except Exception as e:
                 print(f"Error in 3D processing: {e}")
                 traceback.print_exc()
                 analysis_results['error'] = f"3D processing failed: {str(e)}"
         
-        processing_jobs[job_id]['progress'] = 90
+        update_job(job_id, progress=90)
         
         # Generate final analysis report
         processing_end_time = datetime.now()
-        processing_start_time = datetime.fromisoformat(processing_jobs[job_id]['created_at'])
+        processing_start_time = datetime.fromisoformat(running_job(job_id)['created_at'])
         processing_duration = processing_end_time - processing_start_time
         
         # Format processing time
@@ -331,28 +685,116 @@ def process_dicom_files(job_id, file_paths):
         })
         
         # Save comprehensive analysis report
-        report_path = os.path.join(job_result_dir, 'analysis_report.json')
-        with open(report_path, 'w') as f:
-            json.dump(analysis_results, f, indent=2, default=str)
+        report_path = save_report(job_id, analysis_results)
         
         print(f"Analysis report saved: {report_path}")
         
-        processing_jobs[job_id]['status'] = 'completed'
-        processing_jobs[job_id]['progress'] = 100
-        processing_jobs[job_id]['results'] = analysis_results
-        processing_jobs[job_id]['result_dir'] = job_result_dir
+        # The results are all that is served from now on; drop the (much larger) DICOM inputs, unless the
+        # reconstruction failed and they are still needed to look into it or to retry
+        if 'error' not in analysis_results and not running_job(job_id).get('keep_inputs'):
+            shutil.rmtree(os.path.join(UPLOAD_FOLDER, job_id), ignore_errors=True)
+        
+        update_job(job_id, status='completed', progress=100, results=analysis_results, result_dir=job_result_dir)
         
         print(f"Job {job_id} completed successfully!")
         print(f"Results: {analysis_results.get('bone_volume', 'N/A')} volume, {analysis_results.get('surface_area_cm2', 'N/A')} surface area")
         
+    except JobCancelled:
+        discard_cancelled_job(job_id)
     except Exception as e:
-        error_msg = f"Processing failed: {str(e)}"
-        print(f"Error processing job {job_id}: {error_msg}")
-        traceback.print_exc()
-        
-        processing_jobs[job_id]['status'] = 'error'
-        processing_jobs[job_id]['error'] = error_msg
-        processing_jobs[job_id]['traceback'] = traceback.format_exc()
+        fail_job(job_id, e)
+
+def run_job_stage(job_id, job, stage):
+    """Run a processing stage in a worker process and return the resulting job state"""
+    # Workers run in their own process, so seed a private registry with the submitted job
+    seeded = job_id not in processing_jobs
+    if seeded:
+        processing_jobs.create(job_id, job)
+    try:
+        stage()
+        return app.json.loads(app.json.dumps(processing_jobs.get(job_id)))
+    finally:
+        if seeded:
+            processing_jobs.delete(job_id)
+
+def run_job_process(job_id, file_paths, job):
+    """Run a whole job in a local job process"""
+    return run_job_stage(job_id, job, lambda: process_dicom_files(job_id, file_paths))
+
+def init_job_process(update_queue, cancelled):
+    """Set up a local job process to relay its job updates when the store isn't shared"""
+    global job_update_queue, cancelled_jobs, analysis_workers
+    # Every job process starts its own 2D analysis pool, so they share the analysis workers between them
+    analysis_workers = max(1, ANALYSIS_WORKERS // JOB_WORKERS)
+    if not processing_jobs.shared:
+        job_update_queue = update_queue
+        cancelled_jobs = cancelled
+
+def relay_job_updates(update_queue):
+    """Apply job updates relayed by local job processes to this process's store"""
+    while True:
+        job_id, fields = update_queue.get()
+        try:
+            processing_jobs.update(job_id, **fields)
+        except KeyError:
+            pass  # Job was deleted meanwhile
+
+def submit_job(job_id, file_paths, job):
+    """Run a job on the bounded local process pool, or on a thread when JOB_WORKERS is 0"""
+    global job_executor, job_manager, cancelled_jobs
+    if JOB_WORKERS <= 0:
+        thread = threading.Thread(target=process_dicom_files, args=(job_id, file_paths))
+        thread.daemon = True
+        thread.start()
+        return
+    
+    with job_executor_lock:
+        if job_executor is None:
+            # Spawn rather than fork: forking a threaded server can copy locks held by other threads
+            context = multiprocessing.get_context('spawn')
+            update_queue = context.Queue()
+            job_manager = context.Manager()
+            cancelled_jobs = job_manager.dict()
+            threading.Thread(target=relay_job_updates, args=(update_queue,), daemon=True).start()
+            job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=context,
+                                               initializer=init_job_process, initargs=(update_queue, cancelled_jobs))
+    
+    def job_done(future):
+        cancelled_jobs.pop(job_id, None)
+        # A crashed job process can't report its own failure
+        if future.exception() is not None:
+            try:
+                update_job(job_id, status='error', error=f"Processing failed: {future.exception()}")
+            except KeyError:
+                pass
+    
+    job_executor.submit(run_job_process, job_id, file_paths, job).add_done_callback(job_done)
+
+if celery is not None:
+    @celery.task(bind=True, name='analyze_dicom_2d_task')
+    def analyze_dicom_2d_task(self, job_id, file_paths, job):
+        """Run the 2D stage and hand its partial report to the 3D stage through the result directory"""
+        def stage():
+            analysis_results = analyze_dicom_2d(job_id, file_paths)
+            if analysis_results is not None:
+                save_report(job_id, analysis_results)
+        return run_job_stage(job_id, job, stage)
+    
+    @celery.task(bind=True, name='reconstruct_dicom_3d_task')
+    def reconstruct_dicom_3d_task(self, job, job_id, file_paths):
+        """Run the 3D stage on the job state returned by the 2D stage"""
+        if job.get('status') == 'error':
+            return job
+        def stage():
+            with open(os.path.join(RESULTS_FOLDER, job_id, RESULT_FILES['report'])) as f:
+                analysis_results = app.json.loads(f.read())
+            reconstruct_dicom_3d(job_id, file_paths, analysis_results)
+        return run_job_stage(job_id, job, stage)
+    
+    @celery.task(name='cleanup_job_task')
+    def cleanup_job_task(job_id):
+        """Remove a deleted or evicted job's files"""
+        remove_job_files(job_id)
 
 @app.route('/', methods=['GET'])
 def root():
@@ -366,6 +808,7 @@ def root():
             'upload': '/api/upload',
             'jobs': '/api/jobs',
             'job_status': '/api/jobs/<job_id>',
+            'job_events': '/api/jobs/<job_id>/events',
             'job_results': '/api/jobs/<job_id>/results',
             'download': '/api/jobs/<job_id>/download/<file_type>'
         },
@@ -381,7 +824,9 @@ def health_check():
         'modules_available': {
             'dicom_2d': EnhancedDicom2D is not None,
             'dicom_3d': DicomTo3D is not None
-        }
+        },
+        'task_queue': 'celery' if celery is not None else 'threads',
+        'job_store': processing_jobs.name
     })
 
 @app.route('/api/upload', methods=['POST'])
@@ -396,6 +841,17 @@ def upload_files():
         if not files or all(file.filename == '' for file in files):
             return jsonify({'error': 'No files selected'}), 400
         
+        # Mesh formats to write when the job finishes, e.g. formats=ply,stl (formats=report writes none)
+        formats = request.form.get('formats')
+        if formats is None:
+            formats = DEFAULT_MODEL_FORMATS
+        else:
+            formats = [fmt.strip().lower() for fmt in formats.split(',') if fmt.strip()]
+            unknown = [fmt for fmt in formats if fmt not in RESULT_FILES]
+            if unknown:
+                return jsonify({'error': f"Unknown formats: {', '.join(unknown)}"}), 400
+            formats = [fmt for fmt in MODEL_FORMATS if fmt in formats]
+        
         # Generate job ID
         job_id = str(uuid.uuid4())
         
@@ -403,29 +859,33 @@ def upload_files():
         job_dir = os.path.join(UPLOAD_FOLDER, job_id)
         os.makedirs(job_dir, exist_ok=True)
         
-        # Save uploaded files
+        # Save uploaded files; every file of the request lands in the same flat job directory, so a name
+        # already taken by an earlier upload or ZIP member is made unique with the file's index
         file_paths = []
+        file_digests = []  # SHA-256 of each file in file_paths, computed while it was written
         uploaded_files = []
+        used_names = set()
         
-        for file in files:
+        for index, file in enumerate(files):
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
+                filename = claim_name(secure_filename(file.filename), used_names, index)
                 file_path = os.path.join(job_dir, filename)
-                file.save(file_path)
+                file_size, header, digest = save_upload(file, file_path)
                 
                 # Check if it's a ZIP file
-                if filename.lower().endswith('.zip'):
+                if is_archive(filename):
                     try:
                         # Extract DICOM files from ZIP
-                        extracted_files = extract_dicom_from_zip(file_path, job_dir)
-                        file_paths.extend(extracted_files)
+                        extracted_files = extract_dicom_from_zip(file_path, job_dir, used_names)
                         
-                        # Add extracted files to uploaded_files list
-                        for extracted_file in extracted_files:
+                        # Add extracted files to uploaded_files list, using the sizes recorded in the ZIP
+                        for extracted_file, extracted_size, extracted_digest in extracted_files:
+                            file_paths.append(extracted_file)
+                            file_digests.append(extracted_digest)
                             extracted_filename = os.path.basename(extracted_file)
                             uploaded_files.append({
                                 'filename': f"{filename}/{extracted_filename}",
-                                'size': os.path.getsize(extracted_file),
+                                'size': extracted_size,
                                 'source': 'zip',
                                 'extracted': True
                             })
@@ -435,32 +895,62 @@ def upload_files():
                     except Exception as e:
                         return jsonify({'error': f'Error processing ZIP file {filename}: {str(e)}'}), 400
                 else:
-                    # Regular DICOM file
+                    # Regular DICOM file, validated from the header captured while saving it
+                    if not (has_dicom_header(header, file_size) or parses_as_dicom(file_path)):
+                        print(f"Skipping non-DICOM file: {filename}")
+                        os.remove(file_path)
+                        continue
                     file_paths.append(file_path)
+                    file_digests.append(digest)
                     uploaded_files.append({
                         'filename': filename,
-                        'size': os.path.getsize(file_path),
+                        'size': file_size,
                         'source': 'direct'
                     })
         
         if not file_paths:
             return jsonify({'error': 'No valid DICOM files found in uploaded files'}), 400
         
+        series_hash = series_digest(file_digests) if DEDUPLICATE_UPLOADS else None
+        duplicate_job_id, duplicate_job = find_duplicate_job(series_hash, formats) if series_hash else (None, None)
+        if duplicate_job_id:
+            print(f"Upload matches job {duplicate_job_id}; skipping reprocessing")
+            shutil.rmtree(job_dir, ignore_errors=True)
+            status_url = f'/api/jobs/{duplicate_job_id}/status'
+            # Report the existing job's real state: 200 once it is done, 202 while it is still queued or processing
+            completed = duplicate_job['status'] == 'completed'
+            return jsonify({
+                'job_id': duplicate_job_id,
+                'status': duplicate_job['status'],
+                'cached': True,
+                'files_uploaded': len(file_paths),
+                'status_url': status_url,
+                'events_url': f'/api/jobs/{duplicate_job_id}/events',
+                'message': 'These files were already uploaded; returning the existing job.'
+            }), 200 if completed else 202, {'Location': status_url}
+        
         # Initialize job status
-        processing_jobs[job_id] = {
+        job = {
             'status': 'queued',
             'progress': 0,
             'files': uploaded_files,
+            'formats': formats,
+            'keep_inputs': request.form.get('keep_inputs', '').lower() in ('1', 'true', 'yes'),
+            'series_hash': series_hash,
             'created_at': datetime.now().isoformat()
         }
+        processing_jobs.create(job_id, job)
         
-        # Start processing in background thread
-        thread = threading.Thread(
-            target=process_dicom_files,
-            args=(job_id, file_paths)
-        )
-        thread.daemon = True
-        thread.start()
+        if celery is not None:
+            # Hand the job to the Celery workers; the 2D stage's task id doubles as the job id
+            task_id_2d, task_id_3d = job_task_ids(job_id)
+            chain(
+                analyze_dicom_2d_task.si(job_id, file_paths, job).set(task_id=task_id_2d),
+                reconstruct_dicom_3d_task.s(job_id, file_paths).set(task_id=task_id_3d)
+            ).apply_async()
+        else:
+            # Start processing on the local job process pool
+            submit_job(job_id, file_paths, job)
         
         # Count files by source
         direct_files = [f for f in uploaded_files if f.get('source') == 'direct']
@@ -474,6 +964,8 @@ def upload_files():
         else:
             message += f"Uploaded {len(direct_files)} DICOM files."
         
+        # Processing is asynchronous: 202 Accepted, pointing at the status resource and its event stream
+        status_url = f'/api/jobs/{job_id}/status'
         return jsonify({
             'job_id': job_id,
             'status': 'queued',
@@ -482,8 +974,10 @@ def upload_files():
                 'direct': len(direct_files),
                 'from_zip': len(zip_files)
             },
+            'status_url': status_url,
+            'events_url': f'/api/jobs/{job_id}/events',
             'message': message
-        })
+        }), 202, {'Location': status_url}
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -500,13 +994,16 @@ def get_job_status(job_id):
         return response
     
     try:
-        if job_id not in processing_jobs:
-            print(f"Job {job_id} not found in processing_jobs. Available jobs: {list(processing_jobs.keys())}")
+        # Long-poll with ?wait=<seconds>[&progress=<last seen progress>] instead of polling rapidly
+        wait = min(request.args.get('wait', 0, type=float), MAX_STATUS_WAIT_SECONDS)
+        if wait > 0:
+            job = wait_for_job(job_id, wait, request.args.get('progress', type=int))
+        else:
+            job = get_job(job_id)
+        if job is None:
+            print(f"Job {job_id} not found in processing_jobs. Available jobs: {processing_jobs.job_ids()}")
             return jsonify({'error': 'Job not found'}), 404
         
-        job = processing_jobs[job_id]
-        print(f"Retrieved job {job_id}: {job}")
-        
         # Ensure job has all required fields with safe defaults
         response_data = {
             'job_id': job_id,
@@ -549,55 +1046,132 @@ def get_job_status(job_id):
             'message': 'Failed to retrieve job status'
         }), 500
 
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job_status(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes"""
+    # Subscribe before reading the current state so no update falls in between
+    events_local = celery is None or processing_jobs.shared
+    events = processing_jobs.listen(job_id, timeout=STREAM_KEEPALIVE_SECONDS if events_local else 1)
+    job = get_job(job_id)
+    if job is None:
+        events.close()
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def format_event(data):
+        return f"data: {app.json.dumps(data, sort_keys=False)}\n\n"
+    
+    def generate():
+        state = dict(job, job_id=job_id)
+        try:
+            # Send the full state first, then only the fields that change
+            yield format_event(state)
+            while state.get('status') not in ('completed', 'error'):
+                fields = next(events)
+                if fields is None:
+                    # Nothing arrived in time; re-read the job in case updates happened elsewhere
+                    current = get_job(job_id)
+                    if current is None:
+                        yield format_event({'status': 'error', 'error': 'Job not found'})
+                        return
+                    fields = {name: value for name, value in current.items() if state.get(name) != value}
+                    if not fields:
+                        yield ": keepalive\n\n"
+                        continue
+                state.update(fields)
+                yield format_event(fields)
+        finally:
+            events.close()
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(events.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/jobs/<job_id>/results', methods=['GET'])
 def get_job_results(job_id):
     """Get processing job results"""
-    if job_id not in processing_jobs:
+    job = get_job(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = processing_jobs[job_id]
-    
     if job['status'] != 'completed':
         return jsonify({'error': 'Job not completed yet'}), 400
     
+    # The saved report holds the same results already encoded; serve it as-is, with ETag/304 support
+    result_dir = job.get('result_dir')
+    if result_dir:
+        try:
+            return send_from_directory(os.path.abspath(result_dir), RESULT_FILES['report'],
+                                       conditional=True, etag=True, mimetype=RESULT_MIMETYPES['report'])
+        except NotFound:
+            pass
+    
     return jsonify(job.get('results', {}))
 
 @app.route('/api/jobs/<job_id>/download/<file_type>', methods=['GET'])
 def download_result_file(job_id, file_type):
     """Download result files (STL, OBJ, report, etc.)"""
-    if job_id not in processing_jobs:
+    job = get_job(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
-    job = processing_jobs[job_id]
-    
     if job['status'] != 'completed':
         return jsonify({'error': 'Job not completed yet'}), 400
     
     result_dir = job.get('result_dir')
-    if not result_dir or not os.path.exists(result_dir):
+    if not result_dir:
         return jsonify({'error': 'Result files not found'}), 404
     
-    # Map file types to actual files
-    file_mapping = {
-        'stl': '3d_model.stl',
-        'obj': '3d_model.obj',
-        'ply': '3d_model.ply',
-        'report': 'analysis_report.json'
-    }
-    
-    if file_type not in file_mapping:
+    if file_type not in RESULT_FILES:
         return jsonify({'error': 'Invalid file type'}), 400
     
-    file_path = os.path.join(result_dir, file_mapping[file_type])
+    file_path = os.path.join(result_dir, RESULT_FILES[file_type])
     
-    if not os.path.exists(file_path):
+    # Missing STL and OBJ models are converted from the job's PLY model on first download
+    if file_type in ('stl', 'obj') and not os.path.exists(file_path):
+        convert_model_file(result_dir, file_type, file_path)
+    
+    # Serve the gzip copy as-is when the client accepts it; Range requests then address the compressed bytes
+    filename = RESULT_FILES[file_type]
+    precompressed = (file_type in PRECOMPRESSED_RESULT_TYPES and request.accept_encodings.quality('gzip') > 0
+                     and os.path.exists(f'{file_path}.gz'))
+    if precompressed:
+        file_path = f'{file_path}.gz'
+    
+    # Conditional responses send ETag/Last-Modified, answer If-None-Match with 304 and honor Range requests;
+    # the file's single stat there also tells whether it exists
+    try:
+        response = send_from_directory(os.path.abspath(result_dir), os.path.basename(file_path),
+                                       as_attachment=True, download_name=filename, conditional=True, etag=True,
+                                       mimetype=RESULT_MIMETYPES[file_type], max_age=RESULT_MAX_AGE)
+    except NotFound:
+        formats = job.get('formats', DEFAULT_MODEL_FORMATS)
+        if file_type in MODEL_FORMATS and file_type not in formats and 'ply' not in formats:
+            return jsonify({'error': f'{file_type.upper()} model was not generated; re-upload with formats={file_type}'}), 404
         return jsonify({'error': f'{file_type.upper()} file not found'}), 404
+    if file_type in PRECOMPRESSED_RESULT_TYPES:
+        response.vary.add('Accept-Encoding')
+    if precompressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    # Patient-derived meshes may be kept by the browser, never by shared proxies
+    response.cache_control.public = False
+    response.cache_control.private = True
     
-    return send_file(file_path, as_attachment=True)
+    # Without a server-provided file wrapper, Werkzeug reads 8KB at a time; send large meshes in bigger chunks
+    if (response.status_code == 200 and not app.config['USE_X_SENDFILE']
+            and 'wsgi.file_wrapper' not in request.environ
+            and response.content_length >= LARGE_DOWNLOAD_SIZE):
+        response.response.close()
+        response.response = iter_file_mmap(file_path)
+    
+    return response
 
 @app.route('/api/jobs', methods=['GET'])
 def list_jobs():
     """List all processing jobs"""
+    jobs = [(job_id, get_job(job_id)) for job_id in processing_jobs.job_ids()]
     return jsonify([
         {
             'job_id': job_id,
@@ -606,34 +1180,50 @@ def list_jobs():
             'created_at': job_data.get('created_at'),
             'files_count': len(job_data.get('files', []))
         }
-        for job_id, job_data in processing_jobs.items()
+        for job_id, job_data in jobs if job_data is not None
     ])
 
 @app.route('/api/jobs/<job_id>', methods=['DELETE'])
 def delete_job(job_id):
     """Delete a processing job and its files"""
-    if job_id not in processing_jobs:
+    job = get_job(job_id)
+    if job is None:
         return jsonify({'error': 'Job not found'}), 404
     
     try:
-        # Remove upload directory
-        job_upload_dir = os.path.join(UPLOAD_FOLDER, job_id)
-        if os.path.exists(job_upload_dir):
-            shutil.rmtree(job_upload_dir)
+        if cancelled_jobs is not None and job['status'] not in ('completed', 'error'):
+            # Tell the job process running it to stop; it removes its partial files itself
+            cancelled_jobs[job_id] = True
         
-        # Remove result directory
-        job_result_dir = os.path.join(RESULTS_FOLDER, job_id)
-        if os.path.exists(job_result_dir):
-            shutil.rmtree(job_result_dir)
+        if celery is not None:
+            # Drop a still-queued task, stop a running one before it writes more results, and forget their state
+            for task_id in job_task_ids(job_id):
+                celery.control.revoke(task_id, terminate=True)
+                celery.AsyncResult(task_id).forget()
+            
+            # A terminated task still records its final state, which get_job would rebuild the job from
+            if not processing_jobs.shared:
+                with deleted_job_ids_lock:
+                    deleted_job_ids[job_id] = True
+                    while len(deleted_job_ids) > MAX_JOBS:
+                        deleted_job_ids.popitem(last=False)
         
-        # Remove from memory
-        del processing_jobs[job_id]
+        # Forget the job right away and remove its upload and result directories in the background
+        processing_jobs.delete(job_id)
+        schedule_job_cleanup(job_id)
         
-        return jsonify({'message': 'Job deleted successfully'})
+        return jsonify({'message': 'Job deleted, file cleanup scheduled'}), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.after_request
+def compress_response(response):
+    """Compress responses when Flask-Compress is installed, leaving partial (Range) responses as they are"""
+    if compress is None or response.status_code == 206:
+        return response
+    return compress.after_request(response)
+
 @app.errorhandler(413)
 def too_large(e):
     return jsonify({'error': 'File too large'}), 413
@@ -652,9 +1242,11 @@ if __name__ == '__main__':
     print(f"Results folder: {RESULTS_FOLDER}")
     print(f"Max file size: {MAX_CONTENT_LENGTH / (1024*1024)}MB")
     
-    # Run the Flask app
+    threading.Thread(target=sweep_jobs, daemon=True).start()
+    
+    # Run the Flask development server; in production use gunicorn -c gunicorn.conf.py app:app
     app.run(
-        debug=True,
+        debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'),
         host='0.0.0.0',
         port=5000,
         threaded=True
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Gunicorn Configuration
+Production server settings, used with: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import multiprocessing
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# The in-memory job registry is private to each worker process, so only scale out
+# across processes when jobs are kept in Redis or SQLite
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() if os.environ.get('REDIS_URL') or os.environ.get('JOB_DB_PATH') else 1))
+
+# Threads (or gevent with GUNICORN_WORKER_CLASS=gevent) keep slow uploads, downloads
+# and progress streams from blocking other requests
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+accesslog = '-'
+
+def post_worker_init(worker):
+    """Start sweeping expired jobs and orphaned job directories once the app is loaded"""
+    import threading
+    from app import sweep_jobs
+    threading.Thread(target=sweep_jobs, daemon=True).start()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Job Store Module
+Keeps the processing job registry in process memory, in SQLite or in Redis
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from json_utils import dumps
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+class InMemoryJobStore:
+    """Job registry held in a dict, private to the current process and bounded to max_jobs entries and ttl seconds"""
+
+    name = 'memory'
+    shared = False
+    FINISHED_STATUSES = ('completed', 'error')
+
+    def __init__(self, max_jobs=None, on_evict=None, ttl=None):
+        self._jobs = OrderedDict()
+        self._updated_at = {}
+        self._listeners = {}
+        # Request handlers and processing threads share the registry
+        self._lock = threading.RLock()
+        self.max_jobs = max_jobs
+        self.on_evict = on_evict
+        self.ttl = ttl
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def create(self, job_id, job):
+        """Register a new job, evicting expired finished jobs and the least recently used ones beyond max_jobs"""
+        with self._lock:
+            self._jobs[job_id] = dict(job)
+            self._jobs.move_to_end(job_id)
+            self._updated_at[job_id] = time.monotonic()
+        self._expire()
+
+    def get(self, job_id):
+        """Return a copy of the job's fields, or None if the job is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            self._jobs.move_to_end(job_id)
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        """Update fields of an existing job (raises KeyError for unknown jobs)"""
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._updated_at[job_id] = time.monotonic()
+            listeners = list(self._listeners.get(job_id, ()))
+        for events in listeners:
+            events.put(dict(fields))
+
+    def delete(self, job_id):
+        """Forget a job"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._updated_at.pop(job_id, None)
+
+    def find_series(self, series_hash):
+        """Return the id of the newest job registered with series_hash, or None"""
+        with self._lock:
+            for job_id in reversed(self._jobs):
+                if self._jobs[job_id].get('series_hash') == series_hash:
+                    return job_id
+        return None
+
+    def job_ids(self):
+        """List the ids of all known jobs, evicting finished jobs not updated within the TTL"""
+        self._expire()
+        with self._lock:
+            return list(self._jobs)
+
+    def _expire(self):
+        with self._lock:
+            evicted = self._evict()
+        for evicted_id, evicted_job in evicted:
+            print(f"Evicting job {evicted_id} from the job store")
+            if self.on_evict:
+                self.on_evict(evicted_id, evicted_job)
+
+    def _evict(self):
+        # Jobs still queued or processing are never evicted, so the cap can be exceeded temporarily
+        finished = [job_id for job_id, job in self._jobs.items() if job.get('status') in self.FINISHED_STATUSES]
+        expired = set()
+        if self.ttl is not None:
+            cutoff = time.monotonic() - self.ttl
+            expired.update(job_id for job_id in finished if self._updated_at[job_id] < cutoff)
+        if self.max_jobs is not None and len(self._jobs) - len(expired) > self.max_jobs:
+            remaining = [job_id for job_id in finished if job_id not in expired]
+            expired.update(remaining[:len(self._jobs) - len(expired) - self.max_jobs])
+        return [(job_id, self._pop(job_id)) for job_id in finished if job_id in expired]
+
+    def _pop(self, job_id):
+        self._updated_at.pop(job_id, None)
+        return self._jobs.pop(job_id)
+
+    def listen(self, job_id, timeout=None):
+        """Subscribe to a job's updates; the returned generator yields changed fields, or None after each timeout"""
+        events = self._events(job_id, timeout)
+        next(events)  # Register the listener now, so close() always unregisters it
+        return events
+
+    def _events(self, job_id, timeout):
+        events = queue.Queue()
+        with self._lock:
+            self._listeners.setdefault(job_id, []).append(events)
+        try:
+            yield
+            while True:
+                try:
+                    yield events.get(timeout=timeout)
+                except queue.Empty:
+                    yield None
+        finally:
+            with self._lock:
+                listeners = self._listeners.get(job_id, [])
+                if events in listeners:
+                    listeners.remove(events)
+                if not listeners:
+                    self._listeners.pop(job_id, None)
+
+class RedisJobStore:
+    """Job registry held in Redis hashes, shared by every API and worker process"""
+
+    name = 'redis'
+    shared = True
+    INDEX_KEY = 'jobs:index'
+
+    def __init__(self, url, ttl):
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, job_id):
+        return f'job:{job_id}'
+
+    def _channel(self, job_id):
+        return f'job:{job_id}:progress'
+
+    def _series_key(self, series_hash):
+        return f'series:{series_hash}'
+
+    def _encode(self, fields):
+        # Hash values are strings, so every field is stored JSON-encoded, the same way the API encodes it
+        return {name: dumps(value) for name, value in fields.items()}
+
+    def __contains__(self, job_id):
+        return bool(self.redis.exists(self._key(job_id)))
+
+    def create(self, job_id, job):
+        """Register a new job with a TTL and add it to the jobs index"""
+        key = self._key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=self._encode(job))
+        pipe.expire(key, self.ttl)
+        pipe.sadd(self.INDEX_KEY, job_id)
+        if job.get('series_hash'):
+            pipe.set(self._series_key(job['series_hash']), job_id, ex=self.ttl)
+        pipe.execute()
+
+    def get(self, job_id):
+        """Return the job's fields, or None if the job is unknown or expired"""
+        data = self.redis.hgetall(self._key(job_id))
+        if not data:
+            return None
+        return {name.decode(): json.loads(value) for name, value in data.items()}
+
+    def find_series(self, series_hash):
+        """Return the id of the newest job registered with series_hash, or None"""
+        job_id = self.redis.get(self._series_key(series_hash))
+        return job_id.decode() if job_id else None
+
+    def update(self, job_id, **fields):
+        """Update fields of an existing job in a single round-trip (raises KeyError for unknown jobs)"""
+        key = self._key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.exists(key)
+        pipe.hset(key, mapping=self._encode(fields))
+        pipe.expire(key, self.ttl)
+        pipe.publish(self._channel(job_id), dumps(fields))
+        existed = pipe.execute()[0]
+        if not existed:
+            # The job was deleted meanwhile; don't leave a partial hash behind
+            self.redis.delete(key)
+            raise KeyError(job_id)
+
+    def delete(self, job_id):
+        """Forget a job"""
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key(job_id))
+        pipe.srem(self.INDEX_KEY, job_id)
+        pipe.execute()
+
+    def job_ids(self):
+        """List the ids of all known jobs, pruning index entries whose hash has expired"""
+        job_ids = [job_id.decode() for job_id in self.redis.smembers(self.INDEX_KEY)]
+        if not job_ids:
+            return []
+
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            pipe.exists(self._key(job_id))
+        alive = pipe.execute()
+
+        expired = [job_id for job_id, exists in zip(job_ids, alive) if not exists]
+        if expired:
+            self.redis.srem(self.INDEX_KEY, *expired)
+        return [job_id for job_id, exists in zip(job_ids, alive) if exists]
+
+    def listen(self, job_id, timeout=None):
+        """Subscribe to a job's updates; the returned generator yields changed fields, or None after each timeout"""
+        events = self._events(job_id, timeout)
+        next(events)  # Subscribe now, so close() always releases the connection
+        return events
+
+    def _events(self, job_id, timeout):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(job_id))
+        try:
+            yield
+            while True:
+                message = pubsub.get_message(timeout=timeout)
+                yield json.loads(message['data']) if message else None
+        finally:
+            pubsub.close()
+
+class SQLiteJobStore:
+    """Job registry held in a SQLite database, shared by every API and worker process on one host"""
+
+    name = 'sqlite'
+    shared = True
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        # sqlite3 connections must not be used from several threads at once, so each thread gets its own
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_series ON jobs (json_extract(data, '$.series_hash'))")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _load(self, conn, job_id):
+        row = conn.execute(
+            'SELECT data FROM jobs WHERE id = ? AND updated_at > ?', (job_id, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, job_id):
+        return self._load(self._conn(), job_id) is not None
+
+    def create(self, job_id, job):
+        """Register a new job, replacing any stale row with the same id"""
+        self._conn().execute(
+            'INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)',
+            (job_id, dumps(job), time.time())
+        )
+
+    def get(self, job_id):
+        """Return the job's fields, or None if the job is unknown or expired"""
+        return self._load(self._conn(), job_id)
+
+    def find_series(self, series_hash):
+        """Return the id of the newest job registered with series_hash, or None"""
+        row = self._conn().execute(
+            "SELECT id FROM jobs WHERE json_extract(data, '$.series_hash') = ? AND updated_at > ? "
+            'ORDER BY rowid DESC LIMIT 1', (series_hash, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    def update(self, job_id, **fields):
+        """Update fields of an existing job in a single statement (raises KeyError for unknown jobs)"""
+        # json_set patches the stored document in place, so concurrent writers never lose each other's fields
+        data, params = 'data', []
+        for name, value in fields.items():
+            data = f'json_set({data}, ?, json(?))'
+            params += [f'$."{name}"', dumps(value)]
+        cursor = self._conn().execute(
+            f'UPDATE jobs SET data = {data}, updated_at = ? WHERE id = ?', (*params, time.time(), job_id)
+        )
+        if not cursor.rowcount:
+            raise KeyError(job_id)
+
+    def delete(self, job_id):
+        """Forget a job"""
+        self._conn().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def job_ids(self):
+        """List the ids of all known jobs, pruning rows older than the TTL"""
+        conn = self._conn()
+        conn.execute('DELETE FROM jobs WHERE updated_at <= ?', (time.time() - self.ttl,))
+        return [row[0] for row in conn.execute('SELECT id FROM jobs ORDER BY rowid')]
+
+    def listen(self, job_id, timeout=None):
+        """Subscribe to a job's updates; the returned generator yields changed fields, or None after each timeout"""
+        events = self._events(job_id, timeout)
+        next(events)  # Take the initial snapshot now, so later updates are reported as changes
+        return events
+
+    def _events(self, job_id, timeout):
+        # SQLite has no notifications: poll data_version, which changes whenever another connection commits
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            last = self._load(conn, job_id) or {}
+            yield
+            while True:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                changed = None
+                while not changed and (deadline is None or time.monotonic() < deadline):
+                    time.sleep(self.POLL_INTERVAL)
+                    current_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if current_version == version:
+                        continue
+                    version = current_version
+                    job = self._load(conn, job_id) or {}
+                    changed = {name: value for name, value in job.items() if last.get(name) != value}
+                    last = job
+                yield changed or None
+        finally:
+            conn.close()
+
+def create_job_store(redis_url=None, ttl=24 * 3600, max_jobs=None, on_evict=None, sqlite_path=None):
+    """Create the Redis- or SQLite-backed store when configured, otherwise a bounded in-memory one"""
+    if redis_url:
+        if REDIS_AVAILABLE:
+            print(f"Using Redis job store at {redis_url}")
+            return RedisJobStore(redis_url, ttl)
+        print("Warning: REDIS_URL is set but the redis package is not installed. Using in-memory job store.")
+    elif sqlite_path:
+        print(f"Using SQLite job store at {sqlite_path}")
+        return SQLiteJobStore(sqlite_path, ttl)
+    return InMemoryJobStore(max_jobs, on_evict, ttl)
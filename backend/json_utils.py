@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+JSON Utilities Module
+Encoding job data the same way for API responses and every job store
+"""
+
+import json
+from collections.abc import Sequence
+from flask.json.provider import DefaultJSONProvider
+
+# Optional fast JSON encoder; falls back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_default(obj):
+    """Convert values the JSON encoders don't support (numpy values, pydicom MultiValue, ...)"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, Sequence) and not isinstance(obj, (str, bytes)):
+        return list(obj)
+    # orjson only encodes exact floats and ints; pydicom's DS and IS values are subclasses of them
+    if isinstance(obj, float):
+        return float(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    try:
+        return DefaultJSONProvider.default(obj)
+    except TypeError:
+        return str(obj)
+
+def dumps(value):
+    """Encode a value as a JSON string with json_default, using orjson when it is installed"""
+    if orjson is None:
+        return json.dumps(value, default=json_default)
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
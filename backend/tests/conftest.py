@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+# Make the backend modules importable when pytest is run from the repository or backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_ct_slice(path, index, size=32):
+    """Write a small CT slice: air around a soft-tissue disk with a bone ring, in stored values offset by 1024"""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = CTImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'CT'
+    ds.PatientID = 'P1'
+    ds.InstanceNumber = index + 1
+    ds.ImagePositionPatient = [0.0, 0.0, float(index)]
+    ds.PixelSpacing = [0.5, 0.5]
+    ds.SliceThickness = 1.0
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    ds.RescaleIntercept = -1024
+    ds.RescaleSlope = 1
+    
+    yy, xx = np.mgrid[:size, :size]
+    distance = np.hypot(yy - size / 2, xx - size / 2)
+    pixels = np.full((size, size), 24, dtype=np.int16)
+    pixels[distance < size / 3] = 1064
+    pixels[(distance < size / 3) & (distance > size / 3 - 4)] = 2224
+    ds.PixelData = pixels.tobytes()
+    ds.save_as(path, enforce_file_format=True)
+
+
+@pytest.fixture
+def ct_series(tmp_path):
+    """Factory writing a synthetic CT series into a new directory and returning its file paths"""
+    def make(count=4, name='series', size=32):
+        directory = tmp_path / name
+        directory.mkdir()
+        paths = [str(directory / f'slice_{index:03d}.dcm') for index in range(count)]
+        for index, path in enumerate(paths):
+            write_ct_slice(path, index, size)
+        return paths
+    return make
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+import dicom_processing
+from dicom_processing import DicomTo3D
+
+
+def segment(directory, volume_dtype):
+    reconstruction = DicomTo3D(directory)
+    reconstruction.use_gpu = False
+    reconstruction.volume_dtype = volume_dtype
+    assert reconstruction.load_dicom_series()
+    assert reconstruction.segment_bone_3d()
+    return reconstruction
+
+
+@pytest.mark.parametrize('memmap_bytes', [0, 1])
+def test_integer_volume_gives_the_same_bone_mask(ct_series, monkeypatch, memmap_bytes):
+    directory = os.path.dirname(ct_series(6)[0])
+    reference = segment(directory, np.float32)
+    
+    monkeypatch.setattr(dicom_processing, 'VOLUME_MEMMAP_BYTES', memmap_bytes)
+    stored = segment(directory, np.int16)
+    
+    assert stored.volume.dtype == np.int16
+    assert isinstance(stored.volume, np.memmap) == bool(memmap_bytes)
+    assert stored.bone_voxel_count == reference.bone_voxel_count > 0
+    assert np.array_equal(stored.bone_mask_3d, reference.bone_mask_3d)
+
+
+@pytest.mark.parametrize('block_rows', [2, 3, 32])
+def test_blockwise_integer_smoothing_matches_whole_volume_filter(monkeypatch, block_rows):
+    raw = np.random.default_rng(0).integers(-1024, 3000, (23, 17, 5)).astype(np.int16)
+    expected = np.floor(ndimage.gaussian_filter(raw.astype(np.float32), sigma=0.8))
+    monkeypatch.setattr(dicom_processing, 'VOLUME_BLOCK_ROWS', block_rows)
+    
+    reconstruction = DicomTo3D(None)
+    reconstruction.use_gpu = False
+    reconstruction.volume = raw.copy()
+    reconstruction._smooth_integer_volume(sigma=0.8)
+    
+    assert np.array_equal(reconstruction.volume, expected)
+
+
+@pytest.mark.parametrize('volume_dtype', ['int8', 'uint16', 'float64'])
+def test_storage_types_that_cannot_hold_bone_are_rejected(volume_dtype):
+    reconstruction = DicomTo3D(None)
+    reconstruction.volume_dtype = volume_dtype
+    
+    with pytest.raises(ValueError, match='Unsupported volume type'):
+        reconstruction._storage_dtype()
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pytest
+from pydicom.multival import MultiValue
+from pydicom.valuerep import DSfloat, IS
+
+import job_store
+from json_utils import dumps
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path, monkeypatch):
+    """Every job store backend, each empty"""
+    if request.param == 'memory':
+        return job_store.create_job_store(ttl=60, max_jobs=10)
+    if request.param == 'sqlite':
+        return job_store.create_job_store(ttl=60, sqlite_path=str(tmp_path / 'jobs.db'))
+    fakeredis = pytest.importorskip('fakeredis')
+    if not job_store.REDIS_AVAILABLE:
+        pytest.skip('redis is not installed')
+    monkeypatch.setattr(job_store.redis.Redis, 'from_url', lambda url: fakeredis.FakeRedis())
+    return job_store.create_job_store('redis://test', ttl=60)
+
+
+def test_round_trip(store):
+    store.create('job-1', {'status': 'queued', 'progress': 0, 'files': [{'filename': 'a.dcm', 'size': 10}]})
+    store.update('job-1', status='processing', progress=40)
+    
+    assert 'job-1' in store
+    assert store.get('job-1') == {
+        'status': 'processing', 'progress': 40, 'files': [{'filename': 'a.dcm', 'size': 10}]
+    }
+    assert store.job_ids() == ['job-1']
+
+
+def test_dicom_and_numpy_values_come_back_native(store):
+    results = {
+        'spacing_mm': MultiValue(DSfloat, ['0.5', '0.5']),
+        'rows': IS('512'),
+        'mesh_vertices': np.int64(1234),
+        'bone_volume_cm3': np.float32(10.5),
+        'volume_shape': np.array([32, 32, 4]),
+    }
+    store.create('job-1', {'status': 'processing'})
+    store.update('job-1', status='completed', results=results)
+    
+    # The in-memory store keeps the objects themselves; either way they must encode to the same JSON
+    assert json.loads(dumps(store.get('job-1')['results'])) == {
+        'spacing_mm': [0.5, 0.5],
+        'rows': 512,
+        'mesh_vertices': 1234,
+        'bone_volume_cm3': 10.5,
+        'volume_shape': [32, 32, 4],
+    }
+
+
+def test_update_of_unknown_job_raises_key_error(store):
+    with pytest.raises(KeyError):
+        store.update('missing', progress=10)
+    assert store.get('missing') is None
+
+
+def test_delete_forgets_job(store):
+    store.create('job-1', {'status': 'completed'})
+    store.delete('job-1')
+    
+    assert 'job-1' not in store
+    assert store.get('job-1') is None
+    assert store.job_ids() == []
+
+
+def test_find_series_returns_newest_job(store):
+    store.create('old', {'status': 'completed', 'series_hash': 'abc'})
+    store.create('other', {'status': 'completed', 'series_hash': 'def'})
+    store.create('new', {'status': 'queued', 'series_hash': 'abc'})
+    
+    assert store.find_series('abc') == 'new'
+    assert store.find_series('xyz') is None
+
+
+def test_listen_receives_updates(store):
+    store.create('job-1', {'status': 'queued'})
+    events = store.listen('job-1', timeout=1.0)
+    try:
+        store.update('job-1', progress=55)
+        update = next(events)
+        while update is None:
+            update = next(events)
+        assert update == {'progress': 55}
+    finally:
+        events.close()
+
+
+def test_memory_store_evicts_oldest_finished_jobs():
+    evicted = []
+    store = job_store.create_job_store(max_jobs=2, on_evict=lambda job_id, job: evicted.append(job_id))
+    store.create('running', {'status': 'processing'})
+    store.create('done-1', {'status': 'completed'})
+    store.create('done-2', {'status': 'completed'})
+    store.create('done-3', {'status': 'error'})
+    
+    # Running jobs are never evicted, so only the oldest finished ones make room
+    assert evicted == ['done-1', 'done-2']
+    assert store.job_ids() == ['running', 'done-3']
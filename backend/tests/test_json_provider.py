@@ -0,0 +1,25 @@
+import pytest
+from pydicom.valuerep import DSfloat, IS
+
+import app as backend_app
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def provider(request, monkeypatch):
+    """App JSON provider, once encoding with orjson and once with the standard library"""
+    if request.param == 'orjson':
+        if backend_app.orjson is None:
+            pytest.skip('orjson is not installed')
+    else:
+        monkeypatch.setattr(backend_app, 'orjson', None)
+    return backend_app.app.json
+
+
+def test_dicom_numbers_encode_as_numbers(provider):
+    values = {'slice_thickness': DSfloat('2.5'), 'rows': IS('512'), 'spacing': [DSfloat('0.75'), DSfloat('0.75')]}
+    
+    decoded = provider.loads(provider.dumps(values))
+    
+    assert decoded == {'slice_thickness': 2.5, 'rows': 512, 'spacing': [0.75, 0.75]}
+    assert isinstance(decoded['slice_thickness'], float)
+    assert isinstance(decoded['rows'], int)
@@ -0,0 +1,121 @@
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import upload_utils
+from upload_utils import HashingFile, claim_name, extract_dicom_from_zip, save_upload, series_digest
+
+
+def sha256_of(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def write_zip(path, members, compression=zipfile.ZIP_STORED):
+    """Write a ZIP holding (archive name, source path or bytes) members"""
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for name, source in members:
+            if isinstance(source, bytes):
+                zf.writestr(name, source)
+            else:
+                zf.write(source, name)
+    return str(path)
+
+
+def test_claim_name_prefixes_taken_names():
+    used_names = {'a.dcm'}
+    
+    assert claim_name('b.dcm', used_names, 0) == 'b.dcm'
+    assert claim_name('a.dcm', used_names, 3) == '3_a.dcm'
+    assert claim_name('a.dcm', used_names, 3) == '3_3_a.dcm'
+    assert used_names == {'a.dcm', 'b.dcm', '3_a.dcm', '3_3_a.dcm'}
+
+
+def test_extract_keeps_members_with_the_same_name(tmp_path, ct_series):
+    first, second = ct_series(2, 'first'), ct_series(2, 'second')
+    zip_path = write_zip(tmp_path / 'study.zip', [
+        (f'{folder}/{os.path.basename(path)}', path)
+        for folder, paths in (('a', first), ('b', second)) for path in paths
+    ] + [('a/readme.txt', b'not a DICOM file')])
+    extract_dir = tmp_path / 'out'
+    extract_dir.mkdir()
+    
+    extracted = extract_dicom_from_zip(zip_path, str(extract_dir))
+    
+    paths = [path for path, size, digest in extracted]
+    assert len(paths) == len(set(paths)) == 4
+    assert sorted(os.listdir(extract_dir)) == sorted(os.path.basename(path) for path in paths)
+    # Sizes and digests describe the extracted files, so the upload never reads them back
+    for path, size, digest in extracted:
+        assert size == os.path.getsize(path)
+        assert digest == sha256_of(path)
+    assert sorted(digest for path, size, digest in extracted) == sorted(sha256_of(path) for path in first + second)
+
+
+def test_extract_avoids_names_used_elsewhere_in_the_upload(tmp_path, ct_series):
+    series = ct_series(2)
+    zip_path = write_zip(tmp_path / 'study.zip', [(os.path.basename(path), path) for path in series])
+    used_names = {os.path.basename(series[0])}
+    
+    extracted = extract_dicom_from_zip(zip_path, str(tmp_path), used_names)
+    
+    assert sorted(os.path.basename(path) for path, size, digest in extracted) == [
+        f'0_{os.path.basename(series[0])}', os.path.basename(series[1])
+    ]
+    assert len(used_names) == 3
+
+
+def test_extract_rejects_oversized_archives(tmp_path, ct_series, monkeypatch):
+    series = ct_series(2)
+    zip_path = write_zip(tmp_path / 'study.zip', [(os.path.basename(path), path) for path in series])
+    monkeypatch.setattr(upload_utils, 'MAX_ZIP_TOTAL_SIZE', os.path.getsize(series[0]))
+    
+    with pytest.raises(ValueError, match='too large'):
+        extract_dicom_from_zip(zip_path, str(tmp_path))
+
+
+def test_extract_skips_oversized_and_overly_compressed_members(tmp_path, ct_series, monkeypatch):
+    series = ct_series(1)
+    zip_path = write_zip(tmp_path / 'study.zip', [
+        ('slice.dcm', series[0]),
+        ('bomb.dcm', b'\0' * (1024 * 1024)),
+    ], compression=zipfile.ZIP_DEFLATED)
+    extract_dir = tmp_path / 'out'
+    extract_dir.mkdir()
+    
+    extracted = extract_dicom_from_zip(zip_path, str(extract_dir))
+    assert [os.path.basename(path) for path, size, digest in extracted] == ['slice.dcm']
+    
+    monkeypatch.setattr(upload_utils, 'MAX_ZIP_MEMBER_SIZE', 1024)
+    with pytest.raises(ValueError, match='No valid DICOM files'):
+        extract_dicom_from_zip(zip_path, str(extract_dir))
+
+
+def test_save_upload_hashes_copied_and_linked_uploads(tmp_path, ct_series):
+    source = ct_series(1)[0]
+    with open(source, 'rb') as f:
+        data = f.read()
+    
+    copied = FileStorage(io.BytesIO(data), 'copied.dcm')
+    size, header, digest = save_upload(copied, str(tmp_path / 'copied.dcm'))
+    assert (size, header, digest) == (len(data), data[:upload_utils.DICOM_HEADER_SIZE], hashlib.sha256(data).digest())
+    
+    spool = HashingFile(tempfile.NamedTemporaryFile('wb+', dir=tmp_path))
+    spool.write(data)
+    spool.seek(0)
+    size, header, digest = save_upload(FileStorage(spool, 'linked.dcm'), str(tmp_path / 'linked.dcm'))
+    assert (size, digest) == (len(data), hashlib.sha256(data).digest())
+    assert os.path.samefile(tmp_path / 'linked.dcm', spool.name)
+
+
+def test_series_digest_ignores_order_but_not_content():
+    digests = [hashlib.sha256(data).digest() for data in (b'one', b'two', b'three')]
+    
+    assert series_digest(digests) == series_digest(list(reversed(digests)))
+    assert series_digest(digests) != series_digest(digests[:2])
+    assert series_digest(digests) != series_digest(digests[:2] + [hashlib.sha256(b'four').digest()])
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Upload Utilities Module
+Saving uploaded files, extracting ZIP archives and recognizing DICOM files
+"""
+
+import os
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+ALLOWED_EXTENSIONS = {'dcm', 'dicom', 'zip'}
+ARCHIVE_SUFFIXES = ('.zip',)
+ALLOWED_SUFFIXES = tuple('.' + ext for ext in ALLOWED_EXTENSIONS)
+DICOM_SUFFIXES = ('.dcm', '.dicom', '.dic', '.ima')
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Copy uploads to disk 1MB at a time
+DICOM_HEADER_SIZE = 1024  # Bytes inspected by the cheap DICOM checks
+ZIP_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+# ZIP bomb limits, checked against the sizes recorded in the archive before anything is decompressed
+MAX_ZIP_TOTAL_SIZE = 5 * 1024 ** 3  # Uncompressed size of all candidate members together
+MAX_ZIP_MEMBER_SIZE = 200 * 1024 ** 2  # Far larger than any real DICOM slice
+MAX_ZIP_COMPRESSION_RATIO = 200
+
+# Common DICOM UIDs or tags found near the start of DICOM files
+DICOM_PATTERNS = (
+    b'1.2.840.10008',  # DICOM UID prefix
+    b'DICM',
+    b'\x08\x00\x05\x00',  # Specific Charset tag
+    b'\x08\x00\x16\x00',  # SOP Class UID tag
+    b'\x10\x00\x10\x00',  # Patient Name tag
+)
+
+class HashingFile:
+    """File wrapper that feeds everything written through it to a SHA-256 hash, e.g. while an upload is spooled"""
+    
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+    
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def save_upload(file, file_path):
+    """Stream an uploaded file to disk in fixed-size chunks, returning its size, DICOM header bytes and SHA-256 digest"""
+    # An upload already spooled (and hashed) to a named file on the same filesystem is hard-linked into place, not copied
+    if isinstance(file.stream, HashingFile) and isinstance(getattr(file.stream, 'name', None), str):
+        try:
+            file.stream.flush()
+            os.link(file.stream.name, file_path)
+        except OSError:
+            pass
+        else:
+            file.stream.seek(0)
+            return (os.fstat(file.stream.fileno()).st_size, file.stream.read(DICOM_HEADER_SIZE),
+                    file.stream.sha256.digest())
+    
+    size = 0
+    header = b''
+    file_hash = hashlib.sha256()
+    with open(file_path, 'wb') as out:
+        while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+            if not size:
+                header = chunk[:DICOM_HEADER_SIZE]
+            file_hash.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return size, header, file_hash.digest()
+
+def allowed_file(filename):
+    """Check if file extension is allowed"""
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def is_archive(filename):
+    """Check if an allowed upload is a ZIP archive rather than a single DICOM file"""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+def is_plausible_member(zip_info):
+    """Check a ZIP member's recorded sizes before decompressing it"""
+    if zip_info.file_size > MAX_ZIP_MEMBER_SIZE:
+        return False
+    return zip_info.file_size <= MAX_ZIP_COMPRESSION_RATIO * max(zip_info.compress_size, 1)
+
+def extract_zip_members(zip_path, members, extract_dir):
+    """Extract and validate a batch of (ZIP member, target name) pairs, returning (path, size, SHA-256 digest) for valid DICOM files"""
+    extracted_files = []
+    
+    # ZipFile handles are not thread-safe, so every batch opens its own
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for zip_info, target_name in members:
+            file_path = zip_info.filename
+            try:
+                with zip_ref.open(zip_info) as source:
+                    # Validate from the member's header; only valid DICOM files are written to disk
+                    header = source.read(DICOM_HEADER_SIZE)
+                    header_valid = has_dicom_header(header, zip_info.file_size)
+                    if not header_valid:
+                        source.seek(0)
+                        if not parses_as_dicom(source):
+                            print(f"Skipping non-DICOM file: {os.path.basename(file_path)}")
+                            continue
+                        source.seek(0)
+                    
+                    # Write straight to a flat path, dropping the archive's directory structure, and hash the
+                    # member on the way so the upload's series digest doesn't read it back
+                    extracted_path = os.path.join(extract_dir, target_name)
+                    file_hash = hashlib.sha256()
+                    with open(extracted_path, 'wb') as target:
+                        if header_valid:
+                            file_hash.update(header)
+                            target.write(header)
+                        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                            file_hash.update(chunk)
+                            target.write(chunk)
+                
+                extracted_files.append((extracted_path, zip_info.file_size, file_hash.digest()))
+                print(f"Extracted valid DICOM file: {os.path.basename(file_path)}")
+                        
+            except Exception as e:
+                print(f"Error extracting {file_path}: {e}")
+                continue
+    
+    return extracted_files
+
+def claim_name(name, used_names, prefix):
+    """Return name, prefixed as often as needed to not be in used_names, and record it as used"""
+    while name in used_names:
+        name = f"{prefix}_{name}"
+    used_names.add(name)
+    return name
+
+def extract_dicom_from_zip(zip_path, extract_dir, used_names=None):
+    """Extract DICOM files from ZIP archive with improved detection, returning (path, size, SHA-256 digest) triples"""
+    extracted_files = []
+    
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            # List all entries in the ZIP; their ZipInfo records are reused for extraction
+            info_list = zip_ref.infolist()
+        print(f"ZIP contains {len(info_list)} files: {[os.path.basename(info.filename) for info in info_list[:10]]}")
+        
+        # Filter out directories and get only files
+        files_only = [info for info in info_list if not info.is_dir() and not os.path.basename(info.filename).startswith('.')]
+        
+        # First pass: Look for files with DICOM extensions
+        dicom_files = [info for info in files_only if info.filename.lower().endswith(DICOM_SUFFIXES)]
+        
+        # Second pass: If no DICOM extensions found, check all files by content
+        if not dicom_files:
+            print("No files with DICOM extensions found. Checking all files by content...")
+            potential_files = files_only
+        else:
+            potential_files = dicom_files
+        
+        # Reject ZIP bombs up front; the recorded sizes also cap what zipfile will decompress
+        total_size = sum(info.file_size for info in potential_files)
+        if total_size > MAX_ZIP_TOTAL_SIZE:
+            raise ValueError(f"ZIP contents too large ({total_size / 1024 ** 3:.1f}GB uncompressed)")
+        plausible_files = []
+        for info in potential_files:
+            if is_plausible_member(info):
+                plausible_files.append(info)
+            else:
+                print(f"Skipping oversized or overly compressed file: {os.path.basename(info.filename)}")
+        potential_files = plausible_files
+        
+        # Members are extracted into one flat directory, so members whose file name is taken (by a member in
+        # another folder, or by a file from elsewhere in the upload passed in used_names) get their index as a
+        # prefix; batches never write to the same path
+        if used_names is None:
+            used_names = set()
+        members = [(info, claim_name(os.path.basename(info.filename), used_names, index))
+                   for index, info in enumerate(potential_files)]
+        
+        # Extract and validate files in parallel; decompression releases the GIL
+        workers = max(1, min(ZIP_EXTRACT_WORKERS, len(members)))
+        batch_size = max(1, -(-len(members) // workers))  # At least 1, even when every member was skipped
+        batches = [members[i:i + batch_size] for i in range(0, len(members), batch_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_files in executor.map(lambda batch: extract_zip_members(zip_path, batch, extract_dir), batches):
+                extracted_files.extend(batch_files)
+        
+        if not extracted_files:
+            raise ValueError(f"No valid DICOM files found in ZIP archive. Checked {len(potential_files)} files.")
+        
+        print(f"Successfully extracted {len(extracted_files)} DICOM files")
+        return extracted_files
+            
+    except zipfile.BadZipFile:
+        raise ValueError("Invalid ZIP file format")
+    except Exception as e:
+        raise ValueError(f"Error extracting ZIP file: {str(e)}")
+
+def has_dicom_header(header, file_size):
+    """Check the first DICOM_HEADER_SIZE bytes of a file for DICOM markers"""
+    # Method 1: Check for DICOM signature at offset 128
+    # Method 2: Check for DICOM signature at beginning (some DICOM files)
+    if header[128:132] == b'DICM' or header[:4] == b'DICM':
+        return True
+    
+    # Method 3: Check file size and some common DICOM patterns
+    if file_size > 1024:  # DICOM files are usually larger than 1KB
+        return any(pattern in header for pattern in DICOM_PATTERNS)
+    
+    return False
+
+def series_digest(file_digests):
+    """SHA-256 identifying a set of files by their SHA-256 digests, independent of their names and order"""
+    series_hash = hashlib.sha256()
+    for digest in sorted(file_digests):
+        series_hash.update(digest)
+    return series_hash.hexdigest()
+
+def parses_as_dicom(source):
+    """Check whether pydicom can read a DICOM header from a path or file object"""
+    try:
+        import pydicom
+        # Try to read just the header to validate
+        pydicom.dcmread(source, stop_before_pixels=True, force=True)
+        return True
+    except:
+        return False